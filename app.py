@@ -1,8 +1,13 @@
+import hashlib
+import io
+import numpy as np
 import streamlit as st
 import pandas as pd
-import altair as alt
 from pathlib import Path
 
+# ブートストラップ用の乱数生成器（PCG64）
+rng = np.random.default_rng()
+
 # ---------------------------
 # Streamlit 設定
 # ---------------------------
@@ -15,38 +20,137 @@ st.set_page_config(
 st.title("マウス腫瘍体積データ可視化アプリ")
 st.write("CSV（mouse_id / day / group / volume）を読み込み、可視化します。")
 
+# ---------------------------
+# CSV 読み込み（キャッシュ）
+# ---------------------------
+required_cols = {"mouse_id", "day", "group", "volume"}
+
+
+def clean_df(df: pd.DataFrame) -> pd.DataFrame:
+    """day / volume を数値化し、欠損行を除外する（必須カラムがない場合はそのまま返す）"""
+    if not required_cols.issubset(df.columns):
+        return df
+    df["day"] = pd.to_numeric(df["day"], errors="coerce")
+    df["volume"] = pd.to_numeric(df["volume"], errors="coerce")
+    # group / mouse_id はカテゴリ型にして groupby を高速化
+    df["group"] = df["group"].astype("category")
+    df["mouse_id"] = df["mouse_id"].astype("category")
+    df = df.dropna(subset=["day", "volume"])
+    # 欠損行を除いてから day を可能な限り小さい整数型に落とす
+    # （volume は閾値判定・平均の精度のため float64 のまま）
+    df["day"] = pd.to_numeric(df["day"], downcast="integer")
+    # 除外行にしか現れない値をカテゴリから外し、categories を一覧として使えるようにする
+    df["group"] = df["group"].cat.remove_unused_categories()
+    df["mouse_id"] = df["mouse_id"].cat.remove_unused_categories()
+    return df
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_df_by_digest(digest: bytes, _file_bytes: bytes) -> pd.DataFrame:
+    """アップロードされた CSV のバイト列から DataFrame を作成する
+
+    キャッシュキーは内容のダイジェストのみ（同じ CSV の再アップロードを再利用）。
+    キャッシュはメモリ上のみで、アップロードデータはディスクに保存しない。
+    """
+    return clean_df(pd.read_csv(io.BytesIO(_file_bytes)))
+
+
+@st.cache_data(show_spinner=False)
+def load_default_df(path: str, mtime: float) -> pd.DataFrame:
+    """デフォルト CSV を読み込む（mtime をキーに含め、ファイル更新時は再読み込み）"""
+    return clean_df(pd.read_csv(path))
+
+
+def line_chart_spec(color_field: str, height: int) -> dict:
+    """day × volume の折れ線チャート（Vega-Lite spec を直接組み立てる）"""
+    return {
+        "mark": {"type": "line", "point": True},
+        "encoding": {
+            "x": {"field": "day", "type": "quantitative"},
+            "y": {"field": "volume", "type": "quantitative"},
+            "color": {"field": color_field, "type": "nominal"},
+            "tooltip": [
+                {"field": color_field, "type": "nominal"},
+                {"field": "day", "type": "quantitative"},
+                {"field": "volume", "type": "quantitative", "format": ".1f"},
+            ],
+        },
+        "height": height,
+    }
+
+
+def facet_line_chart_spec(color_field: str, facet_field: str, height: int, columns: int = 2) -> dict:
+    """facet_field ごとにパネルを並べた折れ線チャート（1 つの spec で全パネルを描画）"""
+    spec = line_chart_spec(color_field, height)
+    # facet 内では container 幅が使えないため固定幅にする
+    spec["width"] = 450
+    return {
+        "facet": {
+            "field": facet_field,
+            "type": "nominal",
+            "header": {"title": None, "labelExpr": "'Group: ' + datum.value", "labelFontSize": 16},
+        },
+        "columns": columns,
+        "spec": spec,
+        # パネルごとに色スケールと凡例を独立させる（各群の個体だけを凡例に表示）
+        "resolve": {"scale": {"color": "independent"}},
+    }
+
+
+def bootstrap_ci(df_ctrl, df_A, df_B, df_combo, n_boot: int) -> np.ndarray:
+    """ブートストラップ標本ごとの Combination Index を一括計算する（TGI_combo <= 0 の標本は除外）"""
+    # 各群 n_boot 回分のブートストラップ標本平均（n_boot × 群サイズ をまとめて抽出）
+    def boot_means(arr):
+        idx = rng.integers(0, len(arr), size=(n_boot, len(arr)))
+        return arr[idx].mean(axis=1)
+
+    m_ctrl = boot_means(df_ctrl)
+    m_A = boot_means(df_A)
+    m_B = boot_means(df_B)
+    m_combo = boot_means(df_combo)
+
+    # TGI
+    tA = 1 - m_A / m_ctrl
+    tB = 1 - m_B / m_ctrl
+    tC = 1 - m_combo / m_ctrl
+
+    # Bliss effect
+    e_bliss = tA + tB - tA * tB
+
+    mask = tC > 0
+    return e_bliss[mask] / tC[mask]
+
+
 # ---------------------------
 # CSV アップロード
 # ---------------------------
 uploaded_file = st.file_uploader("CSVファイルをアップロードしてください", type=["csv"])
 
 if uploaded_file is not None:
-    df = pd.read_csv(uploaded_file)
+    file_bytes = uploaded_file.getvalue()
+    digest = hashlib.blake2b(file_bytes, digest_size=16).digest()
+    df = load_df_by_digest(digest, file_bytes)
 else:
     st.info("アップロードがないため、data/simulation.csv を読み込みます。")
     default_path = Path("data") / "simulation.csv"
     if default_path.exists():
-        df = pd.read_csv(default_path)
+        df = load_default_df(str(default_path), default_path.stat().st_mtime)
     else:
         st.error("data/simulation.csv が見つかりません。CSV をアップロードしてください。")
         st.stop()
 
 # 必須カラムチェック
-required_cols = {"mouse_id", "day", "group", "volume"}
 if not required_cols.issubset(df.columns):
     st.error("CSV に必要なカラム（mouse_id, day, group, volume）が含まれていません。")
     st.stop()
 
-df["day"] = pd.to_numeric(df["day"], errors="coerce")
-df["volume"] = pd.to_numeric(df["volume"], errors="coerce")
-df = df.dropna(subset=["day", "volume"])
-
 # ---------------------------
 # サイドバー：フィルター & 閾値 & 群指定
 # ---------------------------
 st.sidebar.header("フィルター & 設定")
 
-groups = sorted(df["group"].unique().tolist())
+# カテゴリ型の categories はソート済みの一覧（unique() による全件走査が不要）
+groups = df["group"].cat.categories.tolist()
 selected_groups = st.sidebar.multiselect("Group を選択（解析対象の群）", groups, default=groups)
 
 filtered_df = df[df["group"].isin(selected_groups)]
@@ -93,22 +197,11 @@ if filtered_df.empty:
     st.warning("選択された条件に該当するデータがありません。")
 else:
     group_mean = (
-        filtered_df.groupby(["group", "day"])["volume"]
+        filtered_df.groupby(["group", "day"], observed=True, sort=False)["volume"]
         .mean()
         .reset_index()
     )
-    chart_group = (
-        alt.Chart(group_mean)
-        .mark_line(point=True)
-        .encode(
-            x="day:Q",
-            y="volume:Q",
-            color="group:N",
-            tooltip=["group", "day", "volume"]
-        )
-        .properties(height=400)
-    )
-    st.altair_chart(chart_group, use_container_width=True)
+    st.vega_lite_chart(group_mean, line_chart_spec("group", 400), use_container_width=True)
 
 # ---------------------------
 # 群ごとの個体別腫瘍体積推移（2×2 レイアウト）
@@ -116,60 +209,41 @@ else:
 st.subheader("群ごとの個体別腫瘍体積推移（2×2レイアウト）")
 
 if not filtered_df.empty:
-    grp_list = sorted(filtered_df["group"].unique())
-
-    # 2列ずつ表示
-    for i in range(0, len(grp_list), 2):
-        cols = st.columns(2)
-        for j in range(2):
-            idx = i + j
-            if idx >= len(grp_list):
-                break
-            grp = grp_list[idx]
-            with cols[j]:
-                st.markdown(f"#### Group: {grp}")
-                df_grp = filtered_df[filtered_df["group"] == grp]
-
-                chart_mouse = (
-                    alt.Chart(df_grp)
-                    .mark_line(point=True)
-                    .encode(
-                        x="day:Q",
-                        y="volume:Q",
-                        color="mouse_id:N",
-                        tooltip=["mouse_id", "day", "volume"]
-                    )
-                    .properties(height=300)
-                )
-                st.altair_chart(chart_mouse, use_container_width=True)
+    # 全群を 1 つの facet チャートで 2 列ずつ表示（チャートに必要な列だけをブラウザへ送る）
+    st.vega_lite_chart(
+        filtered_df[["group", "mouse_id", "day", "volume"]],
+        facet_line_chart_spec("mouse_id", "group", 300),
+    )
 
 # ---------------------------
 # 人道的エンドポイント到達個体の「最も早い直前 day」の全個体データ + TGI
 # ---------------------------
 st.subheader("人道的エンドポイント到達個体に対する **最も早い直前 day** の全個体データ + TGI")
 
-tgi_by_group = {}
+tgi_series = pd.Series(dtype=float)
 bliss_value = None
 
+# エンドポイント到達個体がいない場合も CI ブロックで参照できるよう空で初期化
+day_df = pd.DataFrame(columns=filtered_df.columns)
+mean_by_group = pd.Series(dtype=float)
+unique_groups = set()
+
 if filtered_df.empty:
     st.info("データがないため判定できません。")
 else:
-    grouped_mouse = filtered_df.sort_values(["mouse_id", "day"]).groupby("mouse_id")
+    df_sorted = filtered_df.sort_values(["mouse_id", "day"])
+    mouse_codes = df_sorted["mouse_id"].cat.codes.to_numpy()
+    days_np = df_sorted["day"].to_numpy()
+    reached = df_sorted["volume"].to_numpy() >= endpoint_threshold
 
-    target_days = []
+    # 各個体で初めて threshold に到達した行（到達行のうち、直前の到達行と個体が異なるもの）
+    # mouse_id が欠損している行（code = -1）は個体として扱わない
+    hit = np.flatnonzero(reached & (mouse_codes >= 0))
+    first_hit = hit[np.diff(mouse_codes[hit], prepend=-1) != 0]
 
-    # 各個体ごとに、threshold 到達前の day を求めてリストに格納
-    for mouse_id, g in grouped_mouse:
-        g_sorted = g.sort_values("day")
-        reached = g_sorted["volume"] >= endpoint_threshold
-
-        if reached.any():
-            first_idx = reached.idxmax()
-            pos = g_sorted.index.get_loc(first_idx)
-
-            if isinstance(pos, int) and pos > 0:
-                prev_day = g_sorted.iloc[pos - 1]["day"]
-                target_days.append(prev_day)
+    # 初回 day で到達している個体（直前 day なし）は除外し、直前 day を取得
+    first_hit = first_hit[(first_hit > 0) & (mouse_codes[first_hit - 1] == mouse_codes[first_hit])]
+    target_days = days_np[first_hit - 1].tolist()
 
     if target_days:
         # 一番早い day のみを採用
@@ -182,12 +256,15 @@ else:
         )
         day_df = filtered_df[filtered_df["day"] == earliest_day].copy()
 
+        # TGI / CI の両方で使う群平均と群一覧（1 回だけ計算）
+        mean_by_group = day_df.groupby("group", observed=True, sort=False)["volume"].mean()
+        unique_groups = set(day_df["group"].unique())
+
         # --- TGI 計算 ---
-        if control_group not in day_df["group"].unique():
+        if control_group not in unique_groups:
             st.error(f"day = {earliest_day} にコントロール群（{control_group}）のデータがないため、TGI を計算できません。")
             st.dataframe(day_df, use_container_width=True)
         else:
-            mean_by_group = day_df.groupby("group")["volume"].mean()
             mean_control = mean_by_group.get(control_group, None)
 
             if mean_control is None or mean_control <= 0:
@@ -195,12 +272,9 @@ else:
                 st.dataframe(day_df, use_container_width=True)
             else:
                 # TGI(%) = (1 - treated / control) * 100
-                tgi_by_group = {
-                    grp: (1.0 - m / mean_control) * 100.0
-                    for grp, m in mean_by_group.items()
-                }
+                tgi_series = (1.0 - mean_by_group / mean_control) * 100.0
 
-                day_df["TGI(%)"] = day_df["group"].map(tgi_by_group)
+                day_df["TGI(%)"] = day_df["group"].map(tgi_series).astype(float)
                 st.dataframe(day_df, use_container_width=True)
 
                 # ---------------------------
@@ -208,9 +282,9 @@ else:
                 # ---------------------------
                 st.subheader("Bliss independence model による期待 TGI")
 
-                if (drugA_group in tgi_by_group) and (drugB_group in tgi_by_group):
-                    tgiA = tgi_by_group[drugA_group]
-                    tgiB = tgi_by_group[drugB_group]
+                if (drugA_group in tgi_series) and (drugB_group in tgi_series):
+                    tgiA = tgi_series[drugA_group]
+                    tgiB = tgi_series[drugB_group]
 
                     # TGI を 0–1 にスケールして効果 E とみなす
                     EA = tgiA / 100.0
@@ -242,22 +316,21 @@ else:
 # ---------------------------
 st.subheader("Combination Index（CI） と 95%CI（Bootstrap）")
 
-if ("Combo" not in day_df["group"].unique()) and ("A+B" not in day_df["group"].unique()):
+if day_df.empty:
+    st.info("エンドポイント直前 day のデータがないため、CI は計算できません。")
+elif ("Combo" not in unique_groups) and ("A+B" not in unique_groups):
     st.info("Combo 群（A+B）がデータに存在しないため、CI は計算できません。")
 else:
     # Combo 群名の自動検出
     combo_group = None
     for cand in ["Combo", "A+B", "DrugAB", "AB"]:
-        if cand in day_df["group"].unique():
+        if cand in unique_groups:
             combo_group = cand
             break
 
     if combo_group is None:
         st.error("Combo（併用）群が見つかりません。group 名に Combo/A+B/DrugAB を使用してください。")
     else:
-        # --- mean volume ---
-        mean_by_group = day_df.groupby("group")["volume"].mean()
-
         if control_group not in mean_by_group:
             st.error("コントロール群が存在しないため CI を計算できません。")
         else:
@@ -301,43 +374,20 @@ else:
                     value=2000
                 )
 
-                import numpy as np
-
                 # データを群ごとに分割
-                df_ctrl  = day_df[day_df["group"] == control_group]["volume"].values
-                df_A     = day_df[day_df["group"] == drugA_group]["volume"].values
-                df_B     = day_df[day_df["group"] == drugB_group]["volume"].values
-                df_combo = day_df[day_df["group"] == combo_group]["volume"].values
-
-                CI_list = []
-
-                for _ in range(int(n_boot)):
-                    # ブートストラップ標本
-                    boot_ctrl  = np.random.choice(df_ctrl,  size=len(df_ctrl),  replace=True)
-                    boot_A     = np.random.choice(df_A,     size=len(df_A),     replace=True)
-                    boot_B     = np.random.choice(df_B,     size=len(df_B),     replace=True)
-                    boot_combo = np.random.choice(df_combo, size=len(df_combo), replace=True)
-
-                    # 平均
-                    m_ctrl  = boot_ctrl.mean()
-                    m_A     = boot_A.mean()
-                    m_B     = boot_B.mean()
-                    m_combo = boot_combo.mean()
-
-                    # TGI
-                    tA = 1 - m_A / m_ctrl
-                    tB = 1 - m_B / m_ctrl
-                    tC = 1 - m_combo / m_ctrl
-
-                    # Bliss effect
-                    e_bliss = tA + tB - tA * tB
-
-                    if tC > 0:
-                        CI_list.append(e_bliss / tC)
-
-                if len(CI_list) > 10:
-                    CI_low  = np.percentile(CI_list, 2.5)
-                    CI_high = np.percentile(CI_list, 97.5)
+                by_group = {
+                    grp: g["volume"].to_numpy()
+                    for grp, g in day_df.groupby("group", observed=True, sort=False)
+                }
+                df_ctrl  = by_group[control_group]
+                df_A     = by_group[drugA_group]
+                df_B     = by_group[drugB_group]
+                df_combo = by_group[combo_group]
+
+                CI_arr = bootstrap_ci(df_ctrl, df_A, df_B, df_combo, int(n_boot))
+
+                if len(CI_arr) > 10:
+                    CI_low, CI_high = np.percentile(CI_arr, [2.5, 97.5])
 
                     st.markdown(f"""
                     ### **Combination Index 95% CI（Bootstrap）**